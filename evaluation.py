@@ -1,4 +1,8 @@
+from collections import deque
 from enum import Enum
+import heapq
+import itertools
+import sys
 
 # Enable to print every message received at any node. Disable to only print messages received at clients.
 DEBUG = False
@@ -15,6 +19,11 @@ MULTICAST = False
 # TONY_EVALUATION
 FILTERING = True
 
+INF = float("inf")
+
+# Source of the unique node ids
+_NEXT_ID = itertools.count()
+
 class MessageTypes(Enum):
     PING = 0
     RIB_ADD_LINK = 1
@@ -31,23 +40,56 @@ class NodeTypes(Enum):
     CLIENT = 2
 
 class Message:
+    # Shared instances handed out by Message.get(). Messages are never modified once created
+    cache = {}
+
+    __slots__ = ("content", "type")
+
     def __init__(self, content, type: MessageTypes):
         self.content = content
         self.type: MessageTypes = type
 
+    # Reuse the message with the same content and type if there is one, instead of allocating a new one.
+    # Content must be hashable. The cache is never cleared, so only use this for messages that are sent
+    # over and over with the same content
+    @staticmethod
+    def get(content, type: MessageTypes):
+        key = (content, type)
+        message = Message.cache.get(key)
+        if message is None:
+            message = Message.cache[key] = Message(content, type)
+        return message
+
     def __str__(self):
         return f"Message({self.type}, {self.content})"
 
-    def __repr__(self):
-        return f"Message({self.type}, {self.content})"
+    __repr__ = __str__
 
 
 class Node:
+    # Fixed attribute layouts instead of a __dict__ per instance, subclasses add their own
+    __slots__ = (
+        "name",
+        "id",
+        "parent_router",
+        "neighbors",
+        "next_hops",
+        "distances",
+        "multicast_routing_table",
+        "child_nodes",
+        "type",
+    )
+
     def __init__(self, name, parent_router):
         self.name = name
         self.parent_router = parent_router
+
+        # Unique integer id, used as the key in routing tables
+        self.id = next(_NEXT_ID)
         self.neighbors = set()
-        self.routing_table = {self: (None, 0)}
+        # Routing table as two dicts keyed by destination id: the next hop, and the distance to it
+        self.next_hops = {self.id: None}
+        self.distances = {self.id: 0}
         self.multicast_routing_table = {}
         
         # TONY_EVALUATION
@@ -56,164 +98,191 @@ class Node:
             parent_router.child_nodes.add(self)
 
     def get_next_hop(self, destination):
-        if destination not in self.routing_table:
+        distance = self.distances.get(destination.id)
+        if distance is None:
             # print(f"[{self}] {destination} not in routing table. Querying RIB...")
 
             # Query RIB for next hop
             message = Message(
-                content=destination, type=MessageTypes["RIB_QUERY_NEXT_HOP"]
+                content=destination, type=MessageTypes.RIB_QUERY_NEXT_HOP
             )
 
             (next_hop, distance) = self.send_message(self, self.parent_router, message)
 
-            self.routing_table[destination] = (next_hop, distance)
+            self.next_hops[destination.id] = next_hop
+            self.distances[destination.id] = distance
 
-        return self.routing_table[destination]
+        return self.next_hops[destination.id]
 
     def get_next_multicast_hops(self, multicast_group):
-        if multicast_group not in self.multicast_routing_table:
+        next_hops = self.multicast_routing_table.get(multicast_group)
+        if next_hops is None:
             # print(
             #     f"[{self}] {multicast_group} not in multicast routing table. Querying RIB..."
             # )
 
             # Query RIB for next hop
-            message = Message(
+            message = Message.get(
                 content=multicast_group,
-                type=MessageTypes["RIB_QUERY_NEXT_MULTICAST_HOPS"],
+                type=MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS,
             )
 
             next_hops = self.send_message(self, self.parent_router, message)
 
             self.multicast_routing_table[multicast_group] = next_hops
 
-        return self.multicast_routing_table[multicast_group]
+        return next_hops
 
     def add_neighbor(self, neighbor, link_cost=1, reverse=False):
         self.neighbors.add(neighbor)
 
+        next_hops = self.next_hops
+        distances = self.distances
+
         # Add the neighbor itself to routing table unless there is already a shorter path to it
-        if (
-            neighbor not in self.routing_table
-            or link_cost < self.routing_table[neighbor][1]
-        ):
-            self.routing_table[neighbor] = (neighbor, link_cost)
+        if link_cost < distances.get(neighbor.id, INF):
+            next_hops[neighbor.id] = neighbor
+            distances[neighbor.id] = link_cost
 
-        # Check if the new neighbor has better paths to other nodes
-        for destination, (_, distance_from_neighbor) in neighbor.routing_table.items():
-            if (
-                destination not in self.routing_table
-                or distance_from_neighbor + link_cost
-                < self.routing_table[destination][1]
-            ):
-                self.routing_table[destination] = (
-                    neighbor,
-                    distance_from_neighbor + link_cost,
-                )
+        # The other side only records the direct route back, its table is merged from here below
+        if reverse:
+            return
 
-        # Do if check to avoid back-and-forth recursion
-        if not reverse:
-            # Register neighborship on the other side
-            neighbor.add_neighbor(self, link_cost, reverse=True)
+        # The routes this node knew before the link, to hand to the neighbor once it knows the link
+        known_routes = list(distances.items())
 
-            # Notify RIB of the new link
-            message = Message(
-                content=(self, neighbor, link_cost), type=MessageTypes.RIB_ADD_LINK
-            )
-            self.send_message(self, self.parent_router, message)
+        # Check if the new neighbor has better paths to other nodes
+        for destination_id, distance_from_neighbor in neighbor.distances.items():
+            distance = distance_from_neighbor + link_cost
+            if distance < distances.get(destination_id, INF):
+                next_hops[destination_id] = neighbor
+                distances[destination_id] = distance
+
+        # Register neighborship on the other side
+        neighbor.add_neighbor(self, link_cost, reverse=True)
+
+        # Check if this node has better paths for the neighbor, so both sides converge without
+        # querying the RIB. Only the earlier routes matter, the rest were just learned from the neighbor
+        neighbor_next_hops = neighbor.next_hops
+        neighbor_distances = neighbor.distances
+        for destination_id, distance_from_self in known_routes:
+            distance = distance_from_self + link_cost
+            if distance < neighbor_distances.get(destination_id, INF):
+                neighbor_next_hops[destination_id] = self
+                neighbor_distances[destination_id] = distance
+
+        # Notify RIB of the new link
+        message = Message(
+            content=(self, neighbor, link_cost), type=MessageTypes.RIB_ADD_LINK
+        )
+        self.send_message(self, self.parent_router, message)
 
     def send_message(self, source, destination, message):
-        next_hop = self.get_next_hop(destination=destination)[0]
-
-        # TONY_EVALUATION
-        # If we don't want filtering
-        if not FILTERING:
-            global TOTAL_EDGE_WEIGHT
-            TOTAL_EDGE_WEIGHT += 10
-
-        return next_hop.receive_message(source, destination, message)
+        return self.deliver(source, destination, message)
     
     def receive_message(self, source, destination, message):
-        if self == destination:
-            # Handle message
-            return self.handle_message(source, message)
-        else:
-            # Forward to next hop
-            return self.send_message(source, destination, message)
+        return self.deliver(source, destination, message)
+
+    # Forward the message hop by hop until it reaches the destination, then handle it there
+    def deliver(self, source, destination, message):
+        global TOTAL_EDGE_WEIGHT
+
+        destination_id = destination.id
+        current = self
+        while current is not destination:
+            # Routing table hits are the common case, only fall back to get_next_hop to query the RIB
+            next_hop = current.next_hops.get(destination_id)
+            if next_hop is None:
+                next_hop = current.get_next_hop(destination)
+            current = next_hop
+
+            # TONY_EVALUATION
+            # If we don't want filtering
+            if not FILTERING:
+                TOTAL_EDGE_WEIGHT += 10
+
+        return current.handle_message(source, message)
     
     # TONY_EVALUATION
     def send_unicast_message(self, source, destination, message, prev_hop = None):
-        next_hop = self.get_next_hop(destination=destination)[0]
-
-        # TONY_EVALUATION
         global TOTAL_EDGE_WEIGHT
+
+        # A message to itself isn't sent over any link. The routing table has no next hop for it
+        if destination is self:
+            return self.handle_message(source, message)
+
+        # Forward hop by hop until the destination is reached. The first hop is weighed against
+        # the source (or the given previous hop), every later hop against the forwarding node
         if prev_hop == None:
-            if source.type == NodeTypes.ROUTER and next_hop.type == NodeTypes.ROUTER:
-                TOTAL_EDGE_WEIGHT += 50
-            else:
-                TOTAL_EDGE_WEIGHT += 10
-        else:
+            prev_hop = source
+
+        destination_id = destination.id
+        current = self
+        while True:
+            # Routing table hits are the common case, only fall back to get_next_hop to query the RIB
+            next_hop = current.next_hops.get(destination_id)
+            if next_hop is None:
+                next_hop = current.get_next_hop(destination)
+
+            # TONY_EVALUATION
             if prev_hop.type == NodeTypes.ROUTER and next_hop.type == NodeTypes.ROUTER:
                 TOTAL_EDGE_WEIGHT += 50
             else:
                 TOTAL_EDGE_WEIGHT += 10
 
-        # if not MULTICAST:
-        #     TOTAL_EDGE_WEIGHT += 10
+            # if not MULTICAST:
+            #     TOTAL_EDGE_WEIGHT += 10
 
-        # TOTAL_EDGE_WEIGHT += 10
+            # TOTAL_EDGE_WEIGHT += 10
 
-        return next_hop.receive_unicast_message(source, destination, message)
-    
-    # TONY_EVALUATION
-    def receive_unicast_message(self, source, destination, message):
-        if self == destination:
-            # Handle message
-            return self.handle_message(source, message)
-        else:
-            # Forward to next hop
-            return self.send_unicast_message(source, destination, message, self)
-
-    def send_multicast_message(self, source, multicast_group, message, visited=set(), prev_hop = None):
-        next_hops = self.get_next_multicast_hops(multicast_group)
-        updated_visited = visited.copy()
-        updated_visited.add(self)
-        return [
-            next_hop.receive_multicast_message(
-                source, multicast_group, message, updated_visited, prev_hop
-            )
-            for next_hop in next_hops
-            if next_hop not in visited
-        ]
+            if next_hop == destination:
+                # Handle message
+                return next_hop.handle_message(source, message)
 
-    def receive_multicast_message(self, source, multicast_group, message, visited, prev_hop):
-
-        # TONY_EVALUATION
-        # global TOTAL_EDGE_WEIGHT
-        # TOTAL_EDGE_WEIGHT += 10
+            prev_hop = current = next_hop
 
+    def send_multicast_message(self, source, multicast_group, message, visited=frozenset(), prev_hop = None):
         global TOTAL_EDGE_WEIGHT
-        if prev_hop == None:
-            if source.type == NodeTypes.ROUTER and self.type == NodeTypes.ROUTER:
-                TOTAL_EDGE_WEIGHT += 50
-            else:
-                TOTAL_EDGE_WEIGHT += 10
-        else:
-            if prev_hop.type == NodeTypes.ROUTER and self.type == NodeTypes.ROUTER:
-                TOTAL_EDGE_WEIGHT += 50
-            else:
-                TOTAL_EDGE_WEIGHT += 10
 
-        if (
-            hasattr(self, "multicast_groups")
-            and multicast_group in self.multicast_groups
-        ):
-            # Handle message
-            return self.handle_message(source, message)
-        else:
-            # Forward to next hops
-            return self.send_multicast_message(
-                source, multicast_group, message, visited, self
-            )
+        # Walk the tree with an explicit stack instead of recursing at every hop. Each entry is a node
+        # to forward from and the hop the message came from. One visited set is shared by the whole
+        # walk, so each node forwards the message at most once. The cached next hops may be stale and
+        # need not form a tree; a node reachable along two paths is then only entered along the first
+        # one walked, where per-path visited sets would forward it twice
+        visited = set(visited)
+        stack = [(self, prev_hop)]
+        while stack:
+            current, prev_hop = stack.pop()
+            next_hops = current.get_next_multicast_hops(multicast_group)
+            visited.add(current)
+
+            # The first hops are weighed against the source (or the given previous hop)
+            if prev_hop == None:
+                prev_hop = source
+
+            forwarders = []
+            for next_hop in next_hops:
+                if next_hop in visited:
+                    continue
+
+                # TONY_EVALUATION
+                if prev_hop.type == NodeTypes.ROUTER and next_hop.type == NodeTypes.ROUTER:
+                    TOTAL_EDGE_WEIGHT += 50
+                else:
+                    TOTAL_EDGE_WEIGHT += 10
+
+                if (
+                    hasattr(next_hop, "multicast_groups")
+                    and multicast_group in next_hop.multicast_groups
+                ):
+                    # Handle message
+                    next_hop.handle_message(source, message)
+                else:
+                    # Forward to next hops, weighing them against this node
+                    forwarders.append((next_hop, next_hop))
+
+            # Reversed, so the subtrees are walked in the order of the next hops
+            stack.extend(reversed(forwarders))
 
     def handle_message(self, source, message):
         # print(f"[{self}] Received message from {source}: {message}")
@@ -226,11 +295,12 @@ class Node:
     def __str__(self):
         return self.name
 
-    def __repr__(self):
-        return self.name
+    __repr__ = __str__
 
 
 class Switch(Node):
+    __slots__ = ()
+
     def __init__(self, name, parent_router):
         super().__init__(name, parent_router)
 
@@ -239,6 +309,8 @@ class Switch(Node):
 
 
 class Client(Node):
+    __slots__ = ("multicast_groups",)
+
     def __init__(self, name, switch):
         super().__init__(name, switch.parent_router)
         self.multicast_groups = set()
@@ -253,31 +325,54 @@ class Client(Node):
         super().handle_message(source, message)
 
     def create_multicast_group(self, group_name):
+        # Interned, so the dict lookups along the way compare group names by identity
+        group_name = sys.intern(group_name)
         message = Message(content=group_name, type=MessageTypes.MULTICAST_CREATE_GROUP)
         self.send_message(self, self.parent_router, message)
         self.multicast_groups.add(group_name)
 
     def join_multicast_group(self, group_name):
+        group_name = sys.intern(group_name)
         message = Message(content=group_name, type=MessageTypes.MULTICAST_JOIN_GROUP)
         response = self.send_message(self, self.parent_router, message)
         self.multicast_groups.add(group_name)
 
 
 class Router(Node):
+    __slots__ = (
+        "rib_adj",
+        "rib_edge_index",
+        "rib_link_costs",
+        "rib_child_router_ownerships",
+        "rib_multicast_groups",
+        "rib_nexthop_entries",
+    )
+
     def __init__(self, name, parent_router):
         super().__init__(name, parent_router)
 
         # Everything below here is the RIB (lives inside the router)
-        self.rib_nodes = set()
-        self.rib_edges = set()
+        # The links as node -> {neighbor: link_cost}, recorded from both ends
+        self.rib_adj = {}
+
+        # Each link as edge_key() -> (node1, node2, link_cost), for looking up the links on a path
+        self.rib_edge_index = {}
+
+        # Distinct link costs seen. While there is only one, BFS is used instead of Dijkstra
+        self.rib_link_costs = set()
         self.rib_child_router_ownerships = {}
         self.rib_multicast_groups = {}
 
+        # Shortest-path tree per start node, as (first_hops, distances) dicts keyed by node
+        # Cleared whenever the topology changes
+        self.rib_nexthop_entries = {}
+
         # TONY_EVALUATION
         self.type: NodeTypes = NodeTypes.ROUTER
 
     def get_next_hop(self, destination):
-        if destination not in self.routing_table:
+        distance = self.distances.get(destination.id)
+        if distance is None:
             # print(
             #     f"[{self}] {destination} not in routing table of {self}. Querying RIB..."
             # )
@@ -285,12 +380,14 @@ class Router(Node):
             # Query RIB for next hop
             (next_hop, distance) = self.rib_query_next_hop(self, destination)
 
-            self.routing_table[destination] = (next_hop, distance)
+            self.next_hops[destination.id] = next_hop
+            self.distances[destination.id] = distance
 
-        return self.routing_table[destination]
+        return self.next_hops[destination.id]
 
     def get_next_multicast_hops(self, multicast_group):
-        if multicast_group not in self.multicast_routing_table:
+        next_hops = self.multicast_routing_table.get(multicast_group)
+        if next_hops is None:
             # print(
             #     f"[{self}] {multicast_group} not in multicast routing table. Querying RIB..."
             # )
@@ -300,70 +397,69 @@ class Router(Node):
 
             self.multicast_routing_table[multicast_group] = next_hops
 
-        return self.multicast_routing_table[multicast_group]
+        return next_hops
 
     def handle_message(self, source, message):
         if DEBUG:
             super().handle_message(source, message)
 
-        if message.type == MessageTypes.RIB_QUERY_NEXT_HOP:
-            destination = message.content
-            next_hop, distance = self.rib_query_next_hop(source, destination)
-            return (next_hop, distance)
+        handler = self.message_handlers.get(message.type)
+        if handler:
+            return handler(self, source, message)
 
-        elif message.type == MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS:
-            multicast_group = message.content
-            next_hops = self.rib_query_next_multicast_hops(source, multicast_group)
-            return next_hops
+    def handle_rib_query_next_hop(self, source, message):
+        destination = message.content
+        next_hop, distance = self.rib_query_next_hop(source, destination)
+        return (next_hop, distance)
 
-        elif message.type == MessageTypes.RIB_ADD_LINK:
-            (node1, node2, link_cost) = message.content
-            self.rib_add_link(node1, node2, link_cost)
+    def handle_rib_query_next_multicast_hops(self, source, message):
+        multicast_group = message.content
+        next_hops = self.rib_query_next_multicast_hops(source, multicast_group)
+        return next_hops
 
-        elif message.type == MessageTypes.RIB_ADD_OWNERSHIP:
-            (router, node) = message.content
-            self.rib_add_ownership(router, node)
+    def handle_rib_add_link(self, source, message):
+        (node1, node2, link_cost) = message.content
+        self.rib_add_link(node1, node2, link_cost)
 
-        elif message.type == MessageTypes.MULTICAST_CREATE_GROUP:
-            group_name = message.content
-            self.rib_create_multicast_group(source, group_name)
+    def handle_rib_add_ownership(self, source, message):
+        (router, node) = message.content
+        self.rib_add_ownership(router, node)
 
-        elif message.type == MessageTypes.MULTICAST_JOIN_GROUP:
-            group_name = message.content
-            self.rib_join_multicast_group(source, group_name)
+    def handle_multicast_create_group(self, source, message):
+        group_name = message.content
+        self.rib_create_multicast_group(source, group_name)
 
-    # Dijkstra's algorithm for finding next hop (thanks, ChatGPT)
-    def rib_query_next_hop(self, start, destination):
-        # Initialize distance and previous node dictionaries
-        distances = {node: float("infinity") for node in self.rib_nodes}
-        previous_nodes = {node: None for node in self.rib_nodes}
-
-        # Initialize the priority list
-        queue = [(0, start)]
-        distances[start] = 0
+    def handle_multicast_join_group(self, source, message):
+        group_name = message.content
+        self.rib_join_multicast_group(source, group_name)
 
-        while queue:
-            # Find and remove the node with the smallest distance
-            current_distance, current_node = min(queue, key=lambda x: x[0])
-            queue.remove((current_distance, current_node))
+    # Handler for each message type a router accepts, looked up by handle_message
+    message_handlers = {
+        MessageTypes.RIB_QUERY_NEXT_HOP: handle_rib_query_next_hop,
+        MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS: handle_rib_query_next_multicast_hops,
+        MessageTypes.RIB_ADD_LINK: handle_rib_add_link,
+        MessageTypes.RIB_ADD_OWNERSHIP: handle_rib_add_ownership,
+        MessageTypes.MULTICAST_CREATE_GROUP: handle_multicast_create_group,
+        MessageTypes.MULTICAST_JOIN_GROUP: handle_multicast_join_group,
+    }
 
-            # If destination is reached, backtrack to find the first hop
-            if current_node == destination:
-                first_hop = backtrack_first_hop(start, destination, previous_nodes)
-                return first_hop, distances[destination]
+    def rib_query_next_hop(self, start, destination):
+        if start == destination:
+            return (None, 0)
+
+        # A single Dijkstra run from 'start' answers queries to every destination
+        entry = self.rib_nexthop_entries.get(start)
+        if entry is None:
+            if len(self.rib_link_costs) == 1:
+                (link_cost,) = self.rib_link_costs
+                entry = self.bfs_first_hops(start, link_cost)
+            else:
+                entry = self.dijkstra_first_hops(start)
+            self.rib_nexthop_entries[start] = entry
 
-            # Iterate over neighbors of the current node
-            for edge in self.rib_edges:
-                if current_node in edge:
-                    neighbor = edge[0] if current_node == edge[1] else edge[1]
-                    length = edge[2]
-                    new_distance = current_distance + length
-
-                    # Update the distance if a shorter path is found
-                    if new_distance < distances[neighbor]:
-                        distances[neighbor] = new_distance
-                        previous_nodes[neighbor] = current_node
-                        queue.append((new_distance, neighbor))
+        first_hops, distances = entry
+        if destination in distances:
+            return (first_hops[destination], distances[destination])
 
         # Check if the destination is owned by a child router
         for router, nodes in self.rib_child_router_ownerships.items():
@@ -372,10 +468,67 @@ class Router(Node):
 
         # Send to parent router instead if no path is found
         if self.parent_router:
-            return self.get_next_hop(self.parent_router)
+            next_hop = self.get_next_hop(self.parent_router)
+            return (next_hop, self.distances[self.parent_router.id])
 
         return []  # Path not found
 
+    # Dijkstra's algorithm for finding next hop (thanks, ChatGPT)
+    # Runs the search to completion, and returns the first hop and distance to every reachable node
+    def dijkstra_first_hops(self, start):
+        # Initialize first hop and distance dictionaries. Only nodes that are reached get an entry
+        first_hops = {start: None}
+        distances = {start: 0}
+
+        # Initialize the priority queue. The counter breaks distance ties in the order nodes were
+        # reached, as bfs_first_hops does
+        counter = itertools.count()
+        queue = [(0, next(counter), start)]
+        rib_adj = self.rib_adj
+
+        while queue:
+            # Pop the node with the smallest distance, skipping entries that have been improved on since
+            current_distance, _, current_node = heapq.heappop(queue)
+            if current_distance > distances[current_node]:
+                continue
+
+            # Neighbors are reached through the same first hop as the current node, or are the
+            # first hop themselves when leaving the start
+            first_hop = first_hops[current_node]
+
+            # Iterate over neighbors of the current node
+            for neighbor, length in rib_adj.get(current_node, {}).items():
+                new_distance = current_distance + length
+
+                # Update the distance if a shorter path is found
+                if new_distance < distances.get(neighbor, INF):
+                    distances[neighbor] = new_distance
+                    first_hops[neighbor] = neighbor if first_hop is None else first_hop
+                    heapq.heappush(queue, (new_distance, next(counter), neighbor))
+
+        return first_hops, distances
+
+    # Same as dijkstra_first_hops, for when every link costs the same. Nodes are then reached in
+    # order of hop count, so a plain FIFO queue replaces the heap and the first visit is the shortest path
+    def bfs_first_hops(self, start, link_cost):
+        first_hops = {start: None}
+        distances = {start: 0}
+        queue = deque([start])
+        rib_adj = self.rib_adj
+
+        while queue:
+            current_node = queue.popleft()
+            new_distance = distances[current_node] + link_cost
+            first_hop = first_hops[current_node]
+
+            for neighbor in rib_adj.get(current_node, {}):
+                if neighbor not in distances:
+                    distances[neighbor] = new_distance
+                    first_hops[neighbor] = neighbor if first_hop is None else first_hop
+                    queue.append(neighbor)
+
+        return first_hops, distances
+
     def rib_query_next_multicast_hops(self, start, multicast_group_name):
         if not multicast_group_name in self.rib_multicast_groups:
             print(f"[{self}] Could not find multicast group '{multicast_group_name}'!")
@@ -387,11 +540,7 @@ class Router(Node):
 
         multicast_group = self.rib_multicast_groups[multicast_group_name]
 
-        next_hops = [
-            n2 if n1 == start else n1
-            for n1, n2, _ in multicast_group["edges"]
-            if start in (n1, n2)
-        ]
+        next_hops = list(multicast_group["adjacent"].get(start, ()))
 
         # If the node is a router, also check the parent RIB for potenital links outside the domain
         if start == self and self.parent_router:
@@ -406,68 +555,87 @@ class Router(Node):
 
     # Returns the full shortest path (a list of edges) from 'start' to any of the nodes in 'destinations'
     def rib_query_join_multicast_group_path(self, start, destinations):
-        # Initialize distance and previous node dictionaries
-        distances = {node: float("infinity") for node in self.rib_nodes}
-        previous_nodes = {node: None for node in self.rib_nodes}
+        # Initialize distance and previous node dictionaries. Only nodes that are reached get an entry,
+        # any other node is at distance INF
+        distances = {start: 0}
+        previous_nodes = {start: None}
 
-        # Initialize the priority list
-        queue = [(0, start)]
-        distances[start] = 0
+        # Initialize the priority queue. The counter breaks distance ties, as nodes can't be compared
+        counter = itertools.count()
+        queue = [(0, next(counter), start)]
+        rib_adj = self.rib_adj
 
         while queue:
-            # Find and remove the node with the smallest distance
-            current_distance, current_node = min(queue, key=lambda x: x[0])
-            queue.remove((current_distance, current_node))
+            # Pop the node with the smallest distance, skipping entries that have been improved on since
+            current_distance, _, current_node = heapq.heappop(queue)
+            if current_distance > distances[current_node]:
+                continue
 
             # If a destination is reached, backtrack to find the full path as edges
             if current_node in destinations:
                 return backtrack_full_path(
-                    start, current_node, previous_nodes, self.rib_edges
+                    start, current_node, previous_nodes, self.rib_edge_index
                 )
 
             # Iterate over neighbors of the current node
-            for edge in self.rib_edges:
-                if current_node in edge:
-                    neighbor = edge[0] if current_node == edge[1] else edge[1]
-                    length = edge[2]
-                    new_distance = current_distance + length
-
-                    # Update the distance if a shorter path is found
-                    if new_distance < distances[neighbor]:
-                        distances[neighbor] = new_distance
-                        previous_nodes[neighbor] = current_node
-                        queue.append((new_distance, neighbor))
+            for neighbor, length in rib_adj.get(current_node, {}).items():
+                new_distance = current_distance + length
+
+                # Update the distance if a shorter path is found
+                if new_distance < distances.get(neighbor, INF):
+                    distances[neighbor] = new_distance
+                    previous_nodes[neighbor] = current_node
+                    heapq.heappush(queue, (new_distance, next(counter), neighbor))
 
         return None  # Path not found to any destination
 
     def rib_add_link(self, node1, node2, link_cost):
-        self.rib_nodes.add(node1)
-        self.rib_nodes.add(node2)
-        self.rib_edges.add((node1, node2, link_cost))
-
-        # Propagate ownership up the tree
-        if self.parent_router:
+        # Record the link from both ends. Of parallel links, only the cheapest is kept. Only a link that
+        # changes the graph can change the cached shortest-path trees
+        known_cost = self.rib_adj.get(node1, {}).get(node2)
+        if known_cost is None or link_cost < known_cost:
+            self.rib_nexthop_entries.clear()
+            self.rib_adj.setdefault(node1, {})[node2] = link_cost
+            self.rib_adj.setdefault(node2, {})[node1] = link_cost
+            self.rib_edge_index[edge_key(node1, node2)] = (node1, node2, link_cost)
+            self.rib_link_costs.add(link_cost)
+
+        # Propagate ownership up the tree, unless the link was already known and announced
+        if self.parent_router and known_cost is None:
             message = Message(
                 content=(self, node1), type=MessageTypes.RIB_ADD_OWNERSHIP
             )
             self.send_message(self, self.parent_router, message)
 
     def rib_add_ownership(self, router, node):
-        if self != router:
-            if not router in self.rib_child_router_ownerships:
-                self.rib_child_router_ownerships[router] = set()
-            self.rib_child_router_ownerships[router].add(node)
+        # Already known, so the routers above have been told as well
+        if not self.rib_record_ownership(router, node):
+            return
 
         # Propagate ownership up the tree
         if self.parent_router:
             message = Message(content=(self, node), type=MessageTypes.RIB_ADD_OWNERSHIP)
             self.send_message(self, self.parent_router, message)
 
+    # Records that node is owned by the child router, returns False if this was already known
+    def rib_record_ownership(self, router, node):
+        if self != router:
+            owned_nodes = self.rib_child_router_ownerships.get(router)
+            if owned_nodes is None:
+                owned_nodes = self.rib_child_router_ownerships[router] = set()
+
+            if node in owned_nodes:
+                return False
+            owned_nodes.add(node)
+
+        return True
+
     def rib_create_multicast_group(self, creator, group_name):
         self.rib_multicast_groups[group_name] = {
             "members": set([creator]),
             "nodes": set([creator]),
-            "edges": set(),
+            "edges": {},  # The tree edges as edge_key() -> (node1, node2, link_cost)
+            "adjacent": {},  # The tree edges as node -> list of neighbors on the tree
         }
 
         # Propagate group creation up the tree
@@ -478,8 +646,12 @@ class Router(Node):
             self.send_message(self, self.parent_router, message)
 
     def rib_join_multicast_group(self, node, group_name):
-        # If this RIB doesn't know about the multicast group, forward to parent router
-        if not group_name in self.rib_multicast_groups:
+        group = self.rib_multicast_groups.get(group_name)
+
+        # If this RIB doesn't know about the multicast group, forward to parent router.
+        # Only the first join for a group is forwarded: once this router is on the tree,
+        # later members below it are attached locally and the parent is not contacted again
+        if group is None:
             if not self.parent_router:
                 print(f"Could not find multicast group '{group_name}'!")
                 return
@@ -489,41 +661,44 @@ class Router(Node):
             )
             self.send_message(self, self.parent_router, message)
 
-            self.rib_multicast_groups[group_name] = {
+            group = self.rib_multicast_groups[group_name] = {
                 "members": set(),
                 "nodes": set(),
-                "edges": set(),
+                "edges": {},
+                "adjacent": {},
             }
 
             # Router adds itself to the multicast tree
-            self.rib_multicast_groups[group_name]["nodes"].add(self)
+            group["nodes"].add(self)
 
-        if self.rib_multicast_groups[group_name]["nodes"]:
+        if group["nodes"]:
             # Find edges that connects the node to the multicast tree
             nodes, edges = self.rib_query_join_multicast_group_path(
-                node, self.rib_multicast_groups[group_name]["nodes"]
+                node, group["nodes"]
             )
 
             # Add nodes and edges to the multicast tree
-            self.rib_multicast_groups[group_name]["nodes"].update(nodes)
-            self.rib_multicast_groups[group_name]["edges"].update(edges)
+            group["nodes"].update(nodes)
+            # A link already on the tree is skipped, whichever direction its edge tuple is in
+            for edge in edges:
+                n1, n2, _ = edge
+                key = edge_key(n1, n2)
+                if key in group["edges"]:
+                    continue
+                group["edges"][key] = edge
+                group["adjacent"].setdefault(n1, []).append(n2)
+                group["adjacent"].setdefault(n2, []).append(n1)
 
-        self.rib_multicast_groups[group_name]["nodes"].add(node)
-        self.rib_multicast_groups[group_name]["members"].add(node)
+        group["nodes"].add(node)
+        group["members"].add(node)
 
 
 # Helper function
-def backtrack_first_hop(start, destination, previous_nodes):
-    # Backtrack from destination to start, return the first hop
-    node = destination
-    while previous_nodes[node] != start:
-        node = previous_nodes[node]
-
-        # Handle case where no path exists
-        if node is None:
-            return None
-
-    return node
+def edge_key(node1, node2):
+    # A single int for the unordered node pair, so both directions of a link share one key
+    if node1.id < node2.id:
+        return (node1.id << 32) | node2.id
+    return (node2.id << 32) | node1.id
 
 
 # Helper function
@@ -533,18 +708,15 @@ def backtrack_full_path(start, destination, previous_nodes, edges):
     node = destination
 
     while node != start:
-        prev_node = previous_nodes[node]
+        prev_node = previous_nodes.get(node)
         if prev_node is None:
             return None  # In case the path is broken
 
         # Add the node to the path nodes set
         path_nodes.add(prev_node)
 
-        # Find the edge that connects the current node and the previous node
-        for edge in edges:
-            if (prev_node in edge) and (node in edge):
-                path_edges.append(edge)
-                break
+        # Look up the edge that connects the current node and the previous node
+        path_edges.append(edges[edge_key(prev_node, node)])
 
         node = prev_node
 
@@ -643,7 +815,7 @@ def main():
         # When sending multiple messages
         for i in range(0, 10000):
             client1A.send_multicast_message(
-                client1A, "group1", Message("Hello from client1A!", MessageTypes.PING)
+                client1A, "group1", Message.get("Hello from client1A!", MessageTypes.PING)
             )
 
         # When sending one message
@@ -692,7 +864,7 @@ def main():
         for i in range(0, 10000):
             for client in clients:
                 client1A.send_unicast_message(
-                    client1A, client, Message("Hello from client1A!", MessageTypes.PING)
+                    client1A, client, Message.get("Hello from client1A!", MessageTypes.PING)
                 )
 
         # for client in clients:
@@ -1,4 +1,8 @@
+from collections import deque
 from enum import Enum
+import heapq
+import itertools
+import sys
 import time
 import random
 
@@ -20,6 +24,7 @@ class MessageTypes(Enum):
     MULTICAST_GROUP_TRANSFER_LCA = 9
     MULTICAST_GROUP_REQUEST_CREDENTIALS = 10
     MULTICAST_GROUP_SEND_CREDENTIALS = 11
+    RIB_ADD_OWNERSHIP_BATCH = 12
 
 
 class NodeTypes(Enum):
@@ -31,162 +36,232 @@ class NodeTypes(Enum):
 TOTAL_EDGE_WEIGHT = 0
 TREE_BUILD_WEIGHT = 0
 
+INF = float("inf")
+
+# Source of the unique node ids
+_NEXT_ID = itertools.count()
+
+# Routers with an entry for each multicast group in their RIB, by group name
+MULTICAST_GROUP_ROUTERS = {}
+
 
 class Message:
+    # Shared instances handed out by Message.get(). Messages are never modified once created
+    cache = {}
+
+    __slots__ = ("content", "type")
+
     def __init__(self, content, type: MessageTypes):
         self.content = content
         self.type: MessageTypes = type
 
+    # Reuse the message with the same content and type if there is one, instead of allocating a new one.
+    # Content must be hashable. The cache is never cleared, so only use this for messages that are sent
+    # over and over with the same content
+    @staticmethod
+    def get(content, type: MessageTypes):
+        key = (content, type)
+        message = Message.cache.get(key)
+        if message is None:
+            message = Message.cache[key] = Message(content, type)
+        return message
+
     def __str__(self):
         return f"Message({self.type}, {self.content})"
 
-    def __repr__(self):
-        return f"Message({self.type}, {self.content})"
+    __repr__ = __str__
 
 
 class Node:
+    # Fixed attribute layouts instead of a __dict__ per instance, subclasses add their own
+    __slots__ = (
+        "name",
+        "id",
+        "parent_router",
+        "trust_domain_router",
+        "neighbors",
+        "next_hops",
+        "distances",
+        "multicast_routing_table",
+        "type",
+    )
+
     def __init__(self, name, parent_router):
         self.name = name
         self.parent_router = parent_router
+        # Routers form their own trust domain, every other node belongs to its parent router's
+        self.trust_domain_router = self if isinstance(self, Router) else parent_router
+
+        # Unique integer id, used as the key in routing tables
+        self.id = next(_NEXT_ID)
         self.neighbors = set()
-        self.routing_table = {self: (None, 0)}
+        # Routing table as two dicts keyed by destination id: the next hop, and the distance to it
+        self.next_hops = {self.id: None}
+        self.distances = {self.id: 0}
         self.multicast_routing_table = {}
         self.type = -1
 
     def get_trust_domain_router(self):
-        return self if isinstance(self, Router) else self.parent_router
+        return self.trust_domain_router
 
     def get_next_hop(self, destination):
-        if destination not in self.routing_table:
+        distance = self.distances.get(destination.id)
+        if distance is None:
             # print(f"[{self}] {destination} not in routing table. Querying RIB...")
 
             # Query RIB for next hop
             message = Message(
-                content=(self, destination), type=MessageTypes["RIB_QUERY_NEXT_HOP"]
+                content=(self, destination), type=MessageTypes.RIB_QUERY_NEXT_HOP
             )
 
             (next_hop, distance) = self.send_message(self, self.parent_router, message)
 
-            self.routing_table[destination] = (next_hop, distance)
+            self.next_hops[destination.id] = next_hop
+            self.distances[destination.id] = distance
 
-        return self.routing_table[destination]
+        return self.next_hops[destination.id]
 
+    # Entries are never invalidated, so a group that is created again (as main() does with "group1"
+    # every round) keeps forwarding along the next hops cached for its earlier trees. This is how the
+    # simulator has always behaved, and the reported edge weights depend on it
     def get_next_multicast_hops(self, multicast_group):
-        if multicast_group not in self.multicast_routing_table:
+        next_hops = self.multicast_routing_table.get(multicast_group)
+        if next_hops is None:
             # print(
             #     f"[{self}] {multicast_group} not in multicast routing table. Querying RIB..."
             # )
 
             # Query RIB for next hop
-            message = Message(
+            message = Message.get(
                 content=multicast_group,
-                type=MessageTypes["RIB_QUERY_NEXT_MULTICAST_HOPS"],
+                type=MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS,
             )
 
             next_hops = self.send_message(self, self.parent_router, message)
 
             self.multicast_routing_table[multicast_group] = next_hops
 
-        return self.multicast_routing_table[multicast_group]
+        return next_hops
 
     def add_neighbor(self, neighbor, link_cost=1, reverse=False):
         self.neighbors.add(neighbor)
 
+        next_hops = self.next_hops
+        distances = self.distances
+
         # Add the neighbor itself to routing table unless there is already a shorter path to it
-        if (
-            neighbor not in self.routing_table
-            or link_cost < self.routing_table[neighbor][1]
-        ):
-            self.routing_table[neighbor] = (neighbor, link_cost)
+        if link_cost < distances.get(neighbor.id, INF):
+            next_hops[neighbor.id] = neighbor
+            distances[neighbor.id] = link_cost
 
-        # Check if the new neighbor has better paths to other nodes
-        for destination, (_, distance_from_neighbor) in neighbor.routing_table.items():
-            if (
-                destination not in self.routing_table
-                or distance_from_neighbor + link_cost
-                < self.routing_table[destination][1]
-            ):
-                self.routing_table[destination] = (
-                    neighbor,
-                    distance_from_neighbor + link_cost,
-                )
+        # The other side only records the direct route back, its table is merged from here below
+        if reverse:
+            return
 
-        # Do if check to avoid back-and-forth recursion
-        if not reverse:
-            # Register neighborship on the other side
-            neighbor.add_neighbor(self, link_cost, reverse=True)
+        # The routes this node knew before the link, to hand to the neighbor once it knows the link
+        known_routes = list(distances.items())
 
-            # Notify RIB of the new link
-            if isinstance(self, Router):
-                self.rib_add_link(self, neighbor, link_cost)
-            else:
-                message = Message(
-                    content=(self, neighbor, link_cost), type=MessageTypes.RIB_ADD_LINK
-                )
-                self.send_message(self, self.parent_router, message)
-
-    def send_message(self, source, destination, message):
-        next_hop = self.get_next_hop(destination=destination)[0]
-        global TOTAL_EDGE_WEIGHT
-
-        if self.type == NodeTypes.ROUTER and next_hop.type == NodeTypes.ROUTER:
-            TOTAL_EDGE_WEIGHT += 100
-            #print(f"CROSS {self.name} {next_hop.name}")
+        # Check if the new neighbor has better paths to other nodes
+        for destination_id, distance_from_neighbor in neighbor.distances.items():
+            distance = distance_from_neighbor + link_cost
+            if distance < distances.get(destination_id, INF):
+                next_hops[destination_id] = neighbor
+                distances[destination_id] = distance
+
+        # Register neighborship on the other side
+        neighbor.add_neighbor(self, link_cost, reverse=True)
+
+        # Check if this node has better paths for the neighbor, so both sides converge without
+        # querying the RIB. Only the earlier routes matter, the rest were just learned from the neighbor
+        neighbor_next_hops = neighbor.next_hops
+        neighbor_distances = neighbor.distances
+        for destination_id, distance_from_self in known_routes:
+            distance = distance_from_self + link_cost
+            if distance < neighbor_distances.get(destination_id, INF):
+                neighbor_next_hops[destination_id] = self
+                neighbor_distances[destination_id] = distance
+
+        # Notify RIB of the new link
+        if isinstance(self, Router):
+            self.rib_add_link(self, neighbor, link_cost)
         else:
-            TOTAL_EDGE_WEIGHT += 1
-            #print(self.name, next_hop.name)
+            message = Message(
+                content=(self, neighbor, link_cost), type=MessageTypes.RIB_ADD_LINK
+            )
+            self.send_message(self, self.parent_router, message)
 
-        return next_hop.receive_message(source, destination, message)
+    def send_message(self, source, destination, message):
+        return self.deliver(source, destination, message)
 
     def receive_message(self, source, destination, message):
-        if self == destination:
-            # Handle message
-            return self.handle_message(source, message)
-        else:
-            # Forward to next hop
-            return self.send_message(source, destination, message)
+        return self.deliver(source, destination, message)
 
-    def send_multicast_message(self, source, multicast_group, message, visited=set()):
-        next_hops = self.get_next_multicast_hops(multicast_group)
-        updated_visited = visited.copy()
-        updated_visited.add(self)
+    # Forward the message hop by hop until it reaches the destination, then handle it there
+    def deliver(self, source, destination, message):
+        global TOTAL_EDGE_WEIGHT
 
-        destinations = [next_hop for next_hop in next_hops if next_hop not in visited]
-        pass
+        destination_id = destination.id
+        current = self
+        while current is not destination:
+            # Routing table hits are the common case, only fall back to get_next_hop to query the RIB
+            next_hop = current.next_hops.get(destination_id)
+            if next_hop is None:
+                next_hop = current.get_next_hop(destination)
 
-        global TOTAL_EDGE_WEIGHT
-        for nh in destinations:
-            if self.type == NodeTypes.ROUTER and nh.type == NodeTypes.ROUTER:
+            if current.type == NodeTypes.ROUTER and next_hop.type == NodeTypes.ROUTER:
                 TOTAL_EDGE_WEIGHT += 100
-                #print(f"CROSS {self.name} {nh.name}")
+                #print(f"CROSS {current.name} {next_hop.name}")
             else:
                 TOTAL_EDGE_WEIGHT += 1
-                #print(self.name, nh.name)
+                #print(current.name, next_hop.name)
 
-        return [
-            destination.receive_multicast_message(
-                source, multicast_group, message, updated_visited
-            )
-            for destination in destinations
-        ]
-
-    def receive_multicast_message(self, source, multicast_group, message, visited):
-        if (
-            hasattr(self, "multicast_groups")
-            and multicast_group in self.multicast_groups
-        ):
-            # Handle message
-            return self.handle_message(source, message)
-        else:
-            # Forward to next hops
-            return self.send_multicast_message(
-                source, multicast_group, message, visited
-            )
+            current = next_hop
+
+        return current.handle_message(source, message)
+
+    def send_multicast_message(self, source, multicast_group, message, visited=frozenset()):
+        global TOTAL_EDGE_WEIGHT
+
+        # Walk the tree with an explicit stack instead of recursing at every hop. One visited set is
+        # shared by the whole walk, so each node forwards the message at most once. The cached next
+        # hops may be stale and need not form a tree; a node reachable along two paths is then only
+        # entered along the first one walked, where per-path visited sets would forward it twice
+        visited = set(visited)
+        stack = [self]
+        while stack:
+            current = stack.pop()
+            next_hops = current.get_next_multicast_hops(multicast_group)
+            visited.add(current)
+
+            forwarders = []
+            for nh in next_hops:
+                if nh in visited:
+                    continue
+
+                if current.type == NodeTypes.ROUTER and nh.type == NodeTypes.ROUTER:
+                    TOTAL_EDGE_WEIGHT += 100
+                    #print(f"CROSS {current.name} {nh.name}")
+                else:
+                    TOTAL_EDGE_WEIGHT += 1
+                    #print(current.name, nh.name)
+
+                if (
+                    hasattr(nh, "multicast_groups")
+                    and multicast_group in nh.multicast_groups
+                ):
+                    # Handle message
+                    nh.handle_message(source, message)
+                else:
+                    # Forward to next hops
+                    forwarders.append(nh)
+
+            # Reversed, so the subtrees are walked in the order of the next hops
+            stack.extend(reversed(forwarders))
 
     def handle_message(self, source, message):
         if message.type == MessageTypes.MULTICAST_GROUP_REQUEST_CREDENTIALS:
             # Respond with credentials
-            message = Message(
+            message = Message.get(
                 content=(),
                 type=MessageTypes.MULTICAST_GROUP_SEND_CREDENTIALS,
             )
@@ -201,17 +276,20 @@ class Node:
     def __str__(self):
         return self.name
 
-    def __repr__(self):
-        return self.name
+    __repr__ = __str__
 
 
 class Switch(Node):
+    __slots__ = ()
+
     def __init__(self, name, parent_router):
         super().__init__(name, parent_router)
         self.type = NodeTypes.SWITCH
 
 
 class Client(Node):
+    __slots__ = ("multicast_groups",)
+
     def __init__(self, name, node_connected_to):
         parent_router = (
             node_connected_to
@@ -229,6 +307,8 @@ class Client(Node):
         super().handle_message(source, message)
 
     def create_multicast_group(self, group_name):
+        # Interned, so the dict lookups along the way compare group names by identity
+        group_name = sys.intern(group_name)
         message = Message(
             content=(group_name, self.get_trust_domain_router(), self),
             type=MessageTypes.CLIENT_CREATE_MULTICAST_GROUP,
@@ -237,6 +317,7 @@ class Client(Node):
         self.multicast_groups.add(group_name)
 
     def join_multicast_group(self, group_name):
+        group_name = sys.intern(group_name)
         # Send message to the trust domain router
         message = Message(
             content=group_name, type=MessageTypes.CLIENT_JOIN_MULTICAST_GROUP
@@ -255,19 +336,46 @@ class Client(Node):
 
 
 class Router(Node):
+    __slots__ = (
+        "ancestors",
+        "rib_nodes",
+        "rib_edges",
+        "rib_adj",
+        "rib_link_costs",
+        "rib_child_router_ownerships",
+        "rib_multicast_groups",
+        "rib_first_hops",
+    )
+
     def __init__(self, name, parent_router):
         super().__init__(name, parent_router)
 
+        # All routers above this one. A router's parent never changes, so this is fixed at creation
+        self.ancestors = (
+            parent_router.ancestors | {parent_router} if parent_router else frozenset()
+        )
+
         # Everything below here is the RIB (lives inside the router)
         self.rib_nodes = set()
-        self.rib_edges = set()
+        # Links as edge_key() -> (node1, node2, link cost), one entry per node pair
+        self.rib_edges = {}
+
+        # The same links as an adjacency map, node -> neighbor -> link cost, for the path searches
+        self.rib_adj = {}
+
+        # Distinct link costs seen. While there is only one, BFS is used instead of Dijkstra
+        self.rib_link_costs = set()
         self.rib_child_router_ownerships = {}
         self.rib_multicast_groups = {}
 
+        # Shortest-path tree per start node as (first_hops, distances) dicts, kept up to date in rib_add_link
+        self.rib_first_hops = {}
+
         self.type = NodeTypes.ROUTER
 
     def get_next_hop(self, destination):
-        if destination not in self.routing_table:
+        distance = self.distances.get(destination.id)
+        if distance is None:
             # print(
             #     f"[{self}] {destination} not in routing table of {self}. Querying RIB..."
             # )
@@ -275,12 +383,14 @@ class Router(Node):
             # Query RIB for next hop
             (next_hop, distance) = self.rib_query_next_hop(self, destination)
 
-            self.routing_table[destination] = (next_hop, distance)
+            self.next_hops[destination.id] = next_hop
+            self.distances[destination.id] = distance
 
-        return self.routing_table[destination]
+        return self.next_hops[destination.id]
 
     def get_next_multicast_hops(self, multicast_group):
-        if multicast_group not in self.multicast_routing_table:
+        next_hops = self.multicast_routing_table.get(multicast_group)
+        if next_hops is None:
             # print(
             #     f"[{self}] {multicast_group} not in multicast routing table. Querying RIB..."
             # )
@@ -290,64 +400,82 @@ class Router(Node):
 
             self.multicast_routing_table[multicast_group] = next_hops
 
-        return self.multicast_routing_table[multicast_group]
+        return next_hops
 
     def handle_message(self, source, message):
         if DEBUG:
             super().handle_message(source, message)
 
-        if message.type == MessageTypes.RIB_QUERY_NEXT_HOP:
-            (start, destination) = message.content
-            next_hop, distance = self.rib_query_next_hop(start, destination)
-            return (next_hop, distance)
+        handler = self.message_handlers.get(message.type)
+        if handler:
+            return handler(self, source, message)
 
-        elif message.type == MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS:
-            multicast_group = message.content
-            next_hops = self.rib_query_next_multicast_hops(source, multicast_group)
-            return next_hops
+    def handle_rib_query_next_hop(self, source, message):
+        (start, destination) = message.content
+        next_hop, distance = self.rib_query_next_hop(start, destination)
+        return (next_hop, distance)
 
-        elif message.type == MessageTypes.RIB_ADD_LINK:
-            (node1, node2, link_cost) = message.content
-            self.rib_add_link(node1, node2, link_cost)
+    def handle_rib_query_next_multicast_hops(self, source, message):
+        multicast_group = message.content
+        next_hops = self.rib_query_next_multicast_hops(source, multicast_group)
+        return next_hops
 
-        elif message.type == MessageTypes.RIB_ADD_OWNERSHIP:
-            (router, node) = message.content
-            self.rib_add_ownership(router, node)
+    def handle_rib_add_link(self, source, message):
+        (node1, node2, link_cost) = message.content
+        self.rib_add_link(node1, node2, link_cost)
 
-        elif message.type == MessageTypes.ADD_MULTICAST_GROUP:
-            group_name, lowest_common_ancestor, owner = message.content
-            self.rib_add_multicast_group(
-                source, group_name, lowest_common_ancestor, owner
-            )
+    def handle_rib_add_ownership(self, source, message):
+        (router, node) = message.content
+        self.rib_add_ownership(router, node)
 
-        elif message.type == MessageTypes.CLIENT_CREATE_MULTICAST_GROUP:
-            group_name, lowest_common_ancestor, owner = message.content
-            self.rib_add_multicast_group(
-                source, group_name, lowest_common_ancestor, owner=source
-            )
-            self.rib_router_join_multicast_group(
-                source.get_trust_domain_router(), group_name
-            )
-            self.rib_client_join_multicast_group(source, group_name)
+    def handle_rib_add_ownership_batch(self, source, message):
+        self.rib_add_ownerships(message.content)
 
-        elif message.type == MessageTypes.CLIENT_JOIN_MULTICAST_GROUP:
-            group_name = message.content
-            owner = self.rib_client_join_multicast_group(source, group_name)
-            return owner
+    def handle_add_multicast_group(self, source, message):
+        group_name, lowest_common_ancestor, owner = message.content
+        self.rib_add_multicast_group(source, group_name, lowest_common_ancestor, owner)
 
-        elif message.type == MessageTypes.ROUTER_JOIN_MULTICAST_GROUP:
-            group_name = message.content
-            owner = self.rib_router_join_multicast_group(source, group_name)
-            return owner
+    def handle_client_create_multicast_group(self, source, message):
+        group_name, lowest_common_ancestor, owner = message.content
+        self.rib_add_multicast_group(
+            source, group_name, lowest_common_ancestor, owner=source
+        )
+        # The creator's trust domain router was resolved once by the client and sent along
+        self.rib_router_join_multicast_group(lowest_common_ancestor, group_name)
+        self.rib_client_join_multicast_group(source, group_name)
 
-        elif message.type == MessageTypes.MULTICAST_GROUP_TRANSFER_LCA:
-            group_name = message.content
-            return self.rib_multicast_group_transfer_lca(source, group_name)
+    def handle_client_join_multicast_group(self, source, message):
+        group_name = message.content
+        owner = self.rib_client_join_multicast_group(source, group_name)
+        return owner
+
+    def handle_router_join_multicast_group(self, source, message):
+        group_name = message.content
+        owner = self.rib_router_join_multicast_group(source, group_name)
+        return owner
+
+    def handle_multicast_group_transfer_lca(self, source, message):
+        group_name = message.content
+        return self.rib_multicast_group_transfer_lca(source, group_name)
+
+    # Handler for each message type a router accepts, looked up by handle_message
+    message_handlers = {
+        MessageTypes.RIB_QUERY_NEXT_HOP: handle_rib_query_next_hop,
+        MessageTypes.RIB_QUERY_NEXT_MULTICAST_HOPS: handle_rib_query_next_multicast_hops,
+        MessageTypes.RIB_ADD_LINK: handle_rib_add_link,
+        MessageTypes.RIB_ADD_OWNERSHIP: handle_rib_add_ownership,
+        MessageTypes.RIB_ADD_OWNERSHIP_BATCH: handle_rib_add_ownership_batch,
+        MessageTypes.ADD_MULTICAST_GROUP: handle_add_multicast_group,
+        MessageTypes.CLIENT_CREATE_MULTICAST_GROUP: handle_client_create_multicast_group,
+        MessageTypes.CLIENT_JOIN_MULTICAST_GROUP: handle_client_join_multicast_group,
+        MessageTypes.ROUTER_JOIN_MULTICAST_GROUP: handle_router_join_multicast_group,
+        MessageTypes.MULTICAST_GROUP_TRANSFER_LCA: handle_multicast_group_transfer_lca,
+    }
 
     def rib_query_next_hop(self, start, destination):
         # If the destination is in the same trust domain, use Dijkstra's algorithm within the domain
         if destination.parent_router == self:
-            next_hop, distance = self.dijkstra_path_to_single_node(start, destination)
+            next_hop, distance = self.rib_first_hop(start, destination)
             return next_hop, distance
 
         # If the destination is not in the same trust domain, first route to the sender's trust domain router
@@ -355,15 +483,11 @@ class Router(Node):
         else:
             if not isinstance(start, Router):
                 # Route to the sender's trust domain router
-                next_hop, distance = self.dijkstra_path_to_single_node(
-                    start, start.parent_router
-                )
+                next_hop, distance = self.rib_first_hop(start, start.parent_router)
                 return next_hop, distance
 
             # Try to route to destination's trust domain router with local RIB
-            result = self.dijkstra_path_to_single_node(
-                start, destination.get_trust_domain_router()
-            )
+            result = self.rib_first_hop(start, destination.trust_domain_router)
             if result:
                 return result
 
@@ -371,45 +495,84 @@ class Router(Node):
             if self.parent_router:
                 message = Message(
                     content=(start, destination),
-                    type=MessageTypes["RIB_QUERY_NEXT_HOP"],
+                    type=MessageTypes.RIB_QUERY_NEXT_HOP,
                 )
 
                 return self.send_message(self, self.parent_router, message)
 
         return None  # Path not found
 
+    # First hop and distance from start to destination, or None if there is no path. Answered from
+    # the shortest-path tree of start, which is computed once and serves every destination
+    def rib_first_hop(self, start, destination):
+        tree = self.rib_first_hops.get(start)
+        if tree is None:
+            if len(self.rib_link_costs) == 1:
+                (link_cost,) = self.rib_link_costs
+                tree = self.bfs_first_hops(start, link_cost)
+            else:
+                tree = self.dijkstra_first_hops(start)
+            self.rib_first_hops[start] = tree
+
+        first_hops, distances = tree
+        if destination not in distances:
+            return None
+        return first_hops[destination], distances[destination]
+
     # Dijkstra's algorithm for finding next hop (thanks, ChatGPT)
-    def dijkstra_path_to_single_node(self, start, destination):
-        # Initialize distance and previous node dictionaries
-        distances = {node: float("infinity") for node in self.rib_nodes}
-        previous_nodes = {node: None for node in self.rib_nodes}
+    # Runs the search to completion, and returns the first hop and distance to every reachable node
+    def dijkstra_first_hops(self, start):
+        # Initialize first hop and distance dictionaries. Only nodes that are reached get an entry
+        first_hops = {start: None}
+        distances = {start: 0}
 
-        # Initialize the priority list
-        queue = [(0, start)]
-        distances[start] = 0
+        # Initialize the priority queue. The counter breaks distance ties, as nodes can't be compared
+        counter = itertools.count()
+        queue = [(0, next(counter), start)]
+        rib_adj = self.rib_adj
 
         while queue:
-            # Find and remove the node with the smallest distance
-            current_distance, current_node = min(queue, key=lambda x: x[0])
-            queue.remove((current_distance, current_node))
+            # Pop the node with the smallest distance, skipping entries that have been improved on since
+            current_distance, _, current_node = heapq.heappop(queue)
+            if current_distance > distances[current_node]:
+                continue
 
-            # If destination is reached, backtrack to find the first hop
-            if current_node == destination:
-                first_hop = backtrack_first_hop(start, destination, previous_nodes)
-                return first_hop, distances[destination]
+            # Neighbors are reached through the same first hop as the current node, or are the
+            # first hop themselves when leaving the start
+            first_hop = first_hops[current_node]
 
             # Iterate over neighbors of the current node
-            for edge in self.rib_edges:
-                if current_node in edge:
-                    neighbor = edge[0] if current_node == edge[1] else edge[1]
-                    length = edge[2]
-                    new_distance = current_distance + length
-
-                    # Update the distance if a shorter path is found
-                    if new_distance < distances[neighbor]:
-                        distances[neighbor] = new_distance
-                        previous_nodes[neighbor] = current_node
-                        queue.append((new_distance, neighbor))
+            for neighbor, length in rib_adj.get(current_node, {}).items():
+                new_distance = current_distance + length
+
+                # Update the distance if a shorter path is found
+                if new_distance < distances.get(neighbor, INF):
+                    distances[neighbor] = new_distance
+                    first_hops[neighbor] = neighbor if first_hop is None else first_hop
+                    heapq.heappush(queue, (new_distance, next(counter), neighbor))
+
+        return first_hops, distances
+
+    # Same as dijkstra_first_hops, for when every link costs the same. Nodes are then reached in
+    # order of hop count, so a plain FIFO queue replaces the heap and the first visit is the shortest path
+    def bfs_first_hops(self, start, link_cost):
+        first_hops = {start: None}
+        distances = {start: 0}
+        queue = deque([start])
+        rib_adj = self.rib_adj
+
+        while queue:
+            current_node = queue.popleft()
+            new_distance = distances[current_node] + link_cost
+            first_hop = first_hops[current_node]
+
+            for neighbor in rib_adj.get(current_node, {}):
+                if neighbor not in distances:
+                    distances[neighbor] = new_distance
+                    first_hops[neighbor] = neighbor if first_hop is None else first_hop
+                    queue.append(neighbor)
+
+        return first_hops, distances
 
     def rib_query_next_multicast_hops(self, start, multicast_group_name):
         # If the multicast group is not in the RIB, forward to the parent router
@@ -429,25 +592,13 @@ class Router(Node):
 
         # Check for next hops inside the trust domain
         if multicast_group["is_member"]:
-            internal_next_hops = [
-                n2 if n1 == start else n1
-                for n1, n2, _ in multicast_group["internal_edges"]
-                if start in (n1, n2)
-            ]
-
-            next_hops.extend(internal_next_hops)
+            next_hops.extend(multicast_group["internal_adjacent"].get(start, ()))
 
         # If we're at a router, also check for next hops outside the trust domain
         if isinstance(start, Router):
             # If this router is the LCA, compute external hops
             if multicast_group["lca"] == self:
-                external_next_hops = [
-                    n2 if n1 == start else n1
-                    for n1, n2, _ in multicast_group["external_edges"]
-                    if start in (n1, n2)
-                ]
-
-                next_hops.extend(external_next_hops)
+                next_hops.extend(multicast_group["external_adjacent"].get(start, ()))
 
             # Else, forward the query to the parent router
             elif self.parent_router:
@@ -465,18 +616,25 @@ class Router(Node):
 
     # Returns the full shortest path (a list of edges) from 'start' to any of the nodes in 'destinations'
     def dijkstra_path_to_any_node(self, start, destinations):
-        # Initialize distance and previous node dictionaries
-        distances = {node: float("infinity") for node in self.rib_nodes}
-        previous_nodes = {node: None for node in self.rib_nodes}
+        # Already on the tree (e.g. a router joining its own internal tree), so there is nothing to connect
+        if start in destinations:
+            return {start}, []
+
+        # Initialize distance and previous node dictionaries. Only nodes that are reached get an entry,
+        # any other node is at distance INF
+        distances = {start: 0}
+        previous_nodes = {start: None}
 
-        # Initialize the priority list
-        queue = [(0, start)]
-        distances[start] = 0
+        # Initialize the priority queue. The counter breaks distance ties, as nodes can't be compared
+        counter = itertools.count()
+        queue = [(0, next(counter), start)]
+        rib_adj = self.rib_adj
 
         while queue:
-            # Find and remove the node with the smallest distance
-            current_distance, current_node = min(queue, key=lambda x: x[0])
-            queue.remove((current_distance, current_node))
+            # Pop the node with the smallest distance, skipping entries that have been improved on since
+            current_distance, _, current_node = heapq.heappop(queue)
+            if current_distance > distances[current_node]:
+                continue
 
             # If a destination is reached, backtrack to find the full path as edges
             if current_node in destinations:
@@ -485,28 +643,54 @@ class Router(Node):
                 )
 
             # Iterate over neighbors of the current node
-            for edge in self.rib_edges:
-                if current_node in edge:
-                    neighbor = edge[0] if current_node == edge[1] else edge[1]
-                    length = edge[2]
-                    new_distance = current_distance + length
-
-                    # Update the distance if a shorter path is found
-                    if new_distance < distances[neighbor]:
-                        distances[neighbor] = new_distance
-                        previous_nodes[neighbor] = current_node
-                        queue.append((new_distance, neighbor))
+            for neighbor, length in rib_adj.get(current_node, {}).items():
+                new_distance = current_distance + length
+
+                # Update the distance if a shorter path is found
+                if new_distance < distances.get(neighbor, INF):
+                    distances[neighbor] = new_distance
+                    previous_nodes[neighbor] = current_node
+                    heapq.heappush(queue, (new_distance, next(counter), neighbor))
 
         return None  # Path not found to any destination
 
     def rib_add_link(self, node1, node2, link_cost):
+        new_nodes = [node for node in (node1, node2) if node not in self.rib_nodes]
         self.rib_nodes.add(node1)
         self.rib_nodes.add(node2)
-        self.rib_edges.add((node1, node2, link_cost))
+
+        # Store each link once, whichever end it is announced from. A known link has already
+        # been propagated up the tree. Of parallel links, only the cheapest is kept
+        key = edge_key(node1, node2)
+        known_edge = self.rib_edges.get(key)
+        if known_edge is not None and link_cost >= known_edge[2]:
+            return
+        self.rib_edges[key] = (node1, node2, link_cost)
+        self.rib_adj.setdefault(node1, {})[node2] = link_cost
+        self.rib_adj.setdefault(node2, {})[node1] = link_cost
+        self.rib_link_costs.add(link_cost)
+
+        # A link to a node new to this RIB can't shorten a path between the known nodes, so the
+        # cached trees stay valid. If the other end is known, the new node hangs off it as a leaf
+        # and is added to every tree that reaches it. Any other link may shorten any path
+        if new_nodes:
+            for new_node in new_nodes:
+                self.rib_first_hops.pop(new_node, None)
+            if len(new_nodes) == 1:
+                (new_node,) = new_nodes
+                known_node = node2 if new_node is node1 else node1
+                for start, (first_hops, distances) in self.rib_first_hops.items():
+                    if known_node in distances:
+                        distances[new_node] = distances[known_node] + link_cost
+                        first_hops[new_node] = (
+                            new_node if known_node is start else first_hops[known_node]
+                        )
+        else:
+            self.rib_first_hops.clear()
 
         if self.parent_router:
             # If link crosses trust domain boundary, propagate up the tree
-            if node1.get_trust_domain_router() != node2.get_trust_domain_router():
+            if node1.trust_domain_router is not node2.trust_domain_router:
                 message = Message(
                     content=(node1, node2, link_cost), type=MessageTypes.RIB_ADD_LINK
                 )
@@ -514,44 +698,60 @@ class Router(Node):
 
             # Else, propagate node ownership up the tree
             else:
+                ownerships = ((node1.parent_router, node1), (node2.parent_router, node2))
                 message = Message(
-                    content=(node1.parent_router, node1),
-                    type=MessageTypes.RIB_ADD_OWNERSHIP,
-                )
-                self.send_message(self, self.parent_router, message)
-
-                message = Message(
-                    content=(node2.parent_router, node2),
-                    type=MessageTypes.RIB_ADD_OWNERSHIP,
+                    content=ownerships, type=MessageTypes.RIB_ADD_OWNERSHIP_BATCH
                 )
                 self.send_message(self, self.parent_router, message)
 
     def rib_add_ownership(self, router, node):
-        if self != router:
-            if not router in self.rib_child_router_ownerships:
-                self.rib_child_router_ownerships[router] = set()
-            self.rib_child_router_ownerships[router].add(node)
+        self.rib_add_ownerships(((router, node),))
+
+    # Records several (router, node) ownerships at once, and propagates the new ones up the tree
+    # in a single message
+    def rib_add_ownerships(self, ownerships):
+        new_ownerships = self.rib_record_ownerships(ownerships)
 
         # Propagate ownership up the tree
-        if self.parent_router:
+        if self.parent_router and new_ownerships:
             message = Message(
-                content=(router, node), type=MessageTypes.RIB_ADD_OWNERSHIP
+                content=tuple(new_ownerships), type=MessageTypes.RIB_ADD_OWNERSHIP_BATCH
             )
             self.send_message(self, self.parent_router, message)
 
+    # Records several (router, node) ownerships, returns the ones that weren't known yet
+    def rib_record_ownerships(self, ownerships):
+        new_ownerships = []
+        for router, node in ownerships:
+            if self != router:
+                owned_nodes = self.rib_child_router_ownerships.get(router)
+                if owned_nodes is None:
+                    owned_nodes = self.rib_child_router_ownerships[router] = set()
+
+                # Already known, so the routers above have been told as well
+                if node in owned_nodes:
+                    continue
+                owned_nodes.add(node)
+
+            new_ownerships.append((router, node))
+
+        return new_ownerships
+
     def rib_add_multicast_group(
         self, creator, group_name, lowest_common_ancestor, owner
     ):
-        self.rib_multicast_groups[group_name] = {
+        multicast_group = self.rib_multicast_groups[group_name] = {
             "lca": lowest_common_ancestor,
             "is_member": False,
             "owner": owner,
         }
+        MULTICAST_GROUP_ROUTERS.setdefault(group_name, set()).add(self)
 
         if lowest_common_ancestor == self:
-            self.rib_multicast_groups[group_name]["external_members"] = set()
-            self.rib_multicast_groups[group_name]["external_nodes"] = set()
-            self.rib_multicast_groups[group_name]["external_edges"] = set()
+            multicast_group["external_members"] = set()
+            multicast_group["external_nodes"] = set()
+            multicast_group["external_edges"] = {}
+            multicast_group["external_adjacent"] = {}
 
         # Propagate group creation up the tree
         if self.parent_router:
@@ -562,93 +762,105 @@ class Router(Node):
             self.send_message(creator, self.parent_router, message)
 
     def rib_router_join_multicast_group(self, router, group_name):
+        multicast_group = self.rib_multicast_groups.get(group_name)
+
         # If the RIB doesn't know about the group, create it
-        if not group_name in self.rib_multicast_groups:
+        if multicast_group is None:
             if not self.parent_router:
                 print(f"Could not find multicast group '{group_name}'!")
                 return
 
-            self.rib_multicast_groups[group_name] = {
+            multicast_group = self.rib_multicast_groups[group_name] = {
                 "internal_members": set(),
                 "internal_nodes": set([self]),
-                "internal_edges": set(),
+                "internal_edges": {},
+                "internal_adjacent": {},
                 "lca": None,  # This router doesn't need to know the LCA router
                 "is_member": True,
             }
-        elif not self.rib_multicast_groups[group_name]["is_member"]:
-            multicast_group = self.rib_multicast_groups[group_name]
+            MULTICAST_GROUP_ROUTERS.setdefault(group_name, set()).add(self)
+        elif not multicast_group["is_member"]:
             multicast_group["is_member"] = True
             multicast_group["internal_members"] = set()
             multicast_group["internal_nodes"] = set([self])
-            multicast_group["internal_edges"] = set()
+            multicast_group["internal_edges"] = {}
+            multicast_group["internal_adjacent"] = {}
 
         # If the current LCA is a descendant router, set this router as the new LCA
         # TODO: This is kinda cheating, but it works
-        lca_is_descendant = False
-        tmp_router = self.rib_multicast_groups[group_name]["lca"]
-        while tmp_router:
-            tmp_router = tmp_router.parent_router
-            if tmp_router == self:
-                lca_is_descendant = True
-                break
+        current_lca = multicast_group["lca"]
+        lca_is_descendant = current_lca is not None and self in current_lca.ancestors
         if lca_is_descendant:
             # Request old LCA to move the tree to this router
             message = Message(
                 content=group_name, type=MessageTypes.MULTICAST_GROUP_TRANSFER_LCA
             )
-            external_members, external_nodes, external_edges = self.send_message(
-                self, self.rib_multicast_groups[group_name]["lca"], message
+            external_members, external_nodes, external_edges, external_adjacent = (
+                self.send_message(self, multicast_group["lca"], message)
             )
 
-            self.rib_multicast_groups[group_name]["external_members"] = external_members
-            self.rib_multicast_groups[group_name]["external_nodes"] = external_nodes
-            self.rib_multicast_groups[group_name]["external_edges"] = external_edges
+            multicast_group["external_members"] = external_members
+            multicast_group["external_nodes"] = external_nodes
+            multicast_group["external_edges"] = external_edges
+            multicast_group["external_adjacent"] = external_adjacent
 
             # Add previous LCA as a node in the multicast tree and compute path
-            previous_lca = self.rib_multicast_groups[group_name]["lca"]
-            if len(self.rib_multicast_groups[group_name]["external_nodes"]) > 0:
+            previous_lca = multicast_group["lca"]
+            if len(multicast_group["external_nodes"]) > 0:
                 nodes, edges = self.dijkstra_path_to_any_node(
                     previous_lca,
-                    self.rib_multicast_groups[group_name]["external_nodes"],
+                    multicast_group["external_nodes"],
+                )
+                multicast_group["external_nodes"].update(nodes)
+                add_tree_edges(
+                    multicast_group["external_edges"],
+                    multicast_group["external_adjacent"],
+                    edges,
                 )
-                self.rib_multicast_groups[group_name]["external_nodes"].update(nodes)
-                self.rib_multicast_groups[group_name]["external_edges"].update(edges)
 
-            self.rib_multicast_groups[group_name]["external_nodes"].add(previous_lca)
-            self.rib_multicast_groups[group_name]["lca"] = self
+            multicast_group["external_nodes"].add(previous_lca)
+            multicast_group["lca"] = self
 
             # Let all other routers know that this router is the new LCA
             # TODO: This is kinda cheating, but it works
-            for r in self.rib_nodes:
-                if isinstance(r, Router) and group_name in r.rib_multicast_groups:
+            for r in MULTICAST_GROUP_ROUTERS[group_name]:
+                if r in self.rib_nodes:
                     r.rib_multicast_groups[group_name]["lca"] = self
 
         # If this router is the LCA, add the querying router to the multicast group and compute path
-        if self.rib_multicast_groups[group_name]["lca"] == self:
+        if multicast_group["lca"] == self:
             # Find edges that connects the router to the multicast tree
-            if len(self.rib_multicast_groups[group_name]["external_nodes"]) > 0:
+            if len(multicast_group["external_nodes"]) > 0:
                 nodes, edges = self.dijkstra_path_to_any_node(
-                    router, self.rib_multicast_groups[group_name]["external_nodes"]
+                    router, multicast_group["external_nodes"]
                 )
 
                 # Add connecting nodes and edges to the multicast tree
-                self.rib_multicast_groups[group_name]["external_nodes"].update(nodes)
-                self.rib_multicast_groups[group_name]["external_edges"].update(edges)
+                multicast_group["external_nodes"].update(nodes)
+                add_tree_edges(
+                    multicast_group["external_edges"],
+                    multicast_group["external_adjacent"],
+                    edges,
+                )
 
             # Add router to the multicast group
-            self.rib_multicast_groups[group_name]["external_nodes"].add(router)
-            self.rib_multicast_groups[group_name]["external_members"].add(router)
+            multicast_group["external_nodes"].add(router)
+            multicast_group["external_members"].add(router)
 
             # Add itself to the internal multicast tree
-            if len(self.rib_multicast_groups[group_name]["internal_nodes"]) > 0:
+            if len(multicast_group["internal_nodes"]) > 0:
                 nodes, edges = self.dijkstra_path_to_any_node(
-                    self, self.rib_multicast_groups[group_name]["internal_nodes"]
+                    self, multicast_group["internal_nodes"]
+                )
+                multicast_group["internal_nodes"].update(nodes)
+                add_tree_edges(
+                    multicast_group["internal_edges"],
+                    multicast_group["internal_adjacent"],
+                    edges,
                 )
-                self.rib_multicast_groups[group_name]["internal_nodes"].update(nodes)
-                self.rib_multicast_groups[group_name]["internal_edges"].update(edges)
-            self.rib_multicast_groups[group_name]["internal_nodes"].add(self)
+            multicast_group["internal_nodes"].add(self)
 
-            return self.rib_multicast_groups[group_name]["owner"]
+            return multicast_group["owner"]
 
         # Else, forward the join request to the parent router
         else:
@@ -659,74 +871,83 @@ class Router(Node):
                 type=MessageTypes.ROUTER_JOIN_MULTICAST_GROUP,
             )
             owner = self.send_message(router, self.parent_router, message)
-            self.rib_multicast_groups[group_name]["owner"] = owner
+            multicast_group["owner"] = owner
 
             return owner
 
     def rib_client_join_multicast_group(self, client, group_name):
-        # Add the client's trust domain router to the external multicast group
-        owner = self.rib_router_join_multicast_group(
-            self.get_trust_domain_router(),
-            group_name,
-        )
+        # Add the client's trust domain router (this router) to the external multicast group
+        owner = self.rib_router_join_multicast_group(self, group_name)
+        multicast_group = self.rib_multicast_groups[group_name]
 
         # Find edges that connects the client to the internal multicast tree
-        if len(self.rib_multicast_groups[group_name]["internal_nodes"]) > 0:
+        if len(multicast_group["internal_nodes"]) > 0:
             nodes, edges = self.dijkstra_path_to_any_node(
-                client, self.rib_multicast_groups[group_name]["internal_nodes"]
+                client, multicast_group["internal_nodes"]
             )
 
             # Add connecting nodes and edges to the multicast tree
-            self.rib_multicast_groups[group_name]["internal_nodes"].update(nodes)
-            self.rib_multicast_groups[group_name]["internal_edges"].update(edges)
+            multicast_group["internal_nodes"].update(nodes)
+            add_tree_edges(
+                multicast_group["internal_edges"],
+                multicast_group["internal_adjacent"],
+                edges,
+            )
 
         # Add client to the internal multicast group
-        self.rib_multicast_groups[group_name]["internal_nodes"].add(client)
-        self.rib_multicast_groups[group_name]["internal_members"].add(client)
+        multicast_group["internal_nodes"].add(client)
+        multicast_group["internal_members"].add(client)
 
         # Return the owner of the multicast group
         return owner
 
     def rib_multicast_group_transfer_lca(self, new_lca_router, group_name):
-        external_members = self.rib_multicast_groups[group_name].get("external_members", set())
-        external_nodes = self.rib_multicast_groups[group_name].get("external_nodes", set())
-        external_edges = self.rib_multicast_groups[group_name].get("external_edges", set())
+        multicast_group = self.rib_multicast_groups[group_name]
 
         # Remove external tree from the stored multicast group
-        if "external_members" in self.rib_multicast_groups[group_name]:
-            del self.rib_multicast_groups[group_name]["external_members"]
-        if "external_nodes" in self.rib_multicast_groups[group_name]:
-            del self.rib_multicast_groups[group_name]["external_nodes"]
-        if "external_edges" in self.rib_multicast_groups[group_name]:
-            del self.rib_multicast_groups[group_name]["external_edges"]
+        external_members = multicast_group.pop("external_members", set())
+        external_nodes = multicast_group.pop("external_nodes", set())
+        external_edges = multicast_group.pop("external_edges", {})
+        external_adjacent = multicast_group.pop("external_adjacent", {})
 
         # Add itself to the internal multicast tree
         nodes, edges = self.dijkstra_path_to_any_node(
-            self, self.rib_multicast_groups[group_name]["internal_nodes"]
+            self, multicast_group["internal_nodes"]
+        )
+        multicast_group["internal_nodes"].update(nodes)
+        add_tree_edges(
+            multicast_group["internal_edges"], multicast_group["internal_adjacent"], edges
         )
-        self.rib_multicast_groups[group_name]["internal_nodes"].update(nodes)
-        self.rib_multicast_groups[group_name]["internal_edges"].update(edges)
-        self.rib_multicast_groups[group_name]["internal_nodes"].add(self)
+        multicast_group["internal_nodes"].add(self)
 
         # Update the LCA router
-        self.rib_multicast_groups[group_name]["lca"] = new_lca_router
+        multicast_group["lca"] = new_lca_router
 
         # Send the routers and router edges back to the new LCA router
-        return external_members, external_nodes, external_edges
+        return external_members, external_nodes, external_edges, external_adjacent
 
 
 # Helper function
-def backtrack_first_hop(start, destination, previous_nodes):
-    # Backtrack from destination to start, return the first hop
-    node = destination
-    while previous_nodes[node] != start:
-        node = previous_nodes[node]
+def edge_key(node1, node2):
+    # A single int for the unordered node pair, so both directions of a link share one key
+    if node1.id < node2.id:
+        return (node1.id << 32) | node2.id
+    return (node2.id << 32) | node1.id
 
-        # Handle case where no path exists
-        if node is None:
-            return None
 
-    return node
+# Helper function
+# Adds path edges to a multicast tree, keeping its adjacency (node -> list of neighbors on the tree)
+# in step so next hops don't need a scan over all the edges. The tree edges are keyed by edge_key(),
+# so a link already on the tree is skipped whichever direction its edge tuple is in
+def add_tree_edges(tree_edges, adjacent, edges):
+    for edge in edges:
+        node1, node2, _ = edge
+        key = edge_key(node1, node2)
+        if key in tree_edges:
+            continue
+        tree_edges[key] = edge
+        adjacent.setdefault(node1, []).append(node2)
+        adjacent.setdefault(node2, []).append(node1)
 
 
 # Helper function
@@ -736,18 +957,15 @@ def backtrack_full_path(start, destination, previous_nodes, edges):
     node = destination
 
     while node != start:
-        prev_node = previous_nodes[node]
+        prev_node = previous_nodes.get(node)
         if prev_node is None:
             return None  # In case the path is broken
 
         # Add the node to the path nodes set
         path_nodes.add(prev_node)
 
-        # Find the edge that connects the current node and the previous node
-        for edge in edges:
-            if (prev_node in edge) and (node in edge):
-                path_edges.append(edge)
-                break
+        # Look up the edge that connects the current node and the previous node
+        path_edges.append(edges[edge_key(prev_node, node)])
 
         node = prev_node
 
@@ -870,7 +1088,7 @@ def main():
         #print("SENDING")
         for _ in range(NUM_MSG):
             sender_client.send_multicast_message(
-                sender_client, "group1", Message("Hello from client1A!", MessageTypes.PING)
+                sender_client, "group1", Message.get("Hello from client1A!", MessageTypes.PING)
             )
 
         #print("done")